@@ -1,19 +1,52 @@
 #!/usr/bin/env python3
 import argparse
+import fnmatch
+import functools
 import hashlib
+import json
+import os
 import re
 import shutil
+import string
 import subprocess
 import sys
 import tempfile
+from collections import defaultdict
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+)
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, NamedTuple, Set, Tuple
 
-MERMAID_FENCE_RE = re.compile(r"^```mermaid\s*$", re.IGNORECASE)
-FENCE_END_RE = re.compile(r"^```\s*$")
-MD_LINK_RE = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+# Only links to .md/.markdown files, optionally with a #fragment
+MD_LINK_RE = re.compile(
+    r"\[([^\]\n]+)\]\(\s*([^)#\n]+\.(?:md|markdown))\s*(?:#([^)\n]*))?\)",
+    re.IGNORECASE,
+)
 ATX_HEADING_RE = re.compile(r"^(#{1,6})\s+(.+?)\s*$")
+SETEXT_UNDERLINE_RE = re.compile(r"^ {0,3}(=+|-+)\s*$")
+CODE_FENCE_RE = re.compile(r"^ {0,3}(`{3,}|~{3,})(.*)$")
 LIST_ITEM_RE = re.compile(r"^(\s*)([-*+]|[0-9]+\.)\s+")
+URL_SCHEME_RE = re.compile(r"^[a-zA-Z][a-zA-Z0-9+\-.]*://")
+FLOW_DIRECTION_RE = re.compile(
+    r"^(flowchart|graph)\s+[A-Z]{2}\b", re.MULTILINE
+)
+MERMAID_NL_RE = re.compile(r"\\n(?P<paren>\s*\()?")
+# One scan for every Mermaid cleanup: \n escapes, edge labels, node labels
+MERMAID_CLEANUP_RE = re.compile(
+    r"(?P<nl>\\n(?P<paren>\s*\()?)"
+    r"|(?P<arrow>--+[->]?)\|(?P<edge>[^|]+)\|"
+    r"|(?P<id>\w+)?\[(?P<node>[^\]]+)\]"
+)
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+MARKDOWN_SUFFIXES = {".md", ".markdown"}
+# Pre-serialized raw LaTeX \newpage block, written between files
+NEWPAGE_SEP = b'{"t":"RawBlock","c":["latex","\\\\newpage"]}'
+MERMAID_FAILED_PLACEHOLDER = (
+    "*[Mermaid diagram could not be rendered - check syntax]*"
+)
 
 
 def die(msg: str, code: int = 2) -> None:
@@ -26,58 +59,253 @@ def which_or_die(cmd: str, install_hint: str) -> None:
         die(f"missing `{cmd}` in PATH. Install: {install_hint}")
 
 
+class _SlugTable(dict):
+    # Keeps [a-z0-9], turns whitespace and hyphens into spaces, drops the rest
+    def __missing__(self, codepoint: int) -> str | None:
+        value = " " if chr(codepoint).isspace() else None
+        self[codepoint] = value
+        return value
+
+
+_SLUG_TRANS = _SlugTable(
+    {ord(c): c for c in "abcdefghijklmnopqrstuvwxyz0123456789"}
+)
+_SLUG_TRANS[ord("-")] = " "
+
+# Same rules for ASCII-only input, as a bytes.translate table: lowercase
+# A-Z, turn whitespace and hyphens into spaces, delete everything else
+_ASCII_SPACES = bytes(c for c in range(128) if chr(c).isspace()) + b"-"
+_ASCII_SLUG_TABLE = bytes.maketrans(
+    string.ascii_uppercase.encode("ascii") + _ASCII_SPACES,
+    string.ascii_lowercase.encode("ascii") + b" " * len(_ASCII_SPACES),
+)
+_ASCII_SLUG_DELETE = bytes(
+    c
+    for c in range(256)
+    if not (chr(c).isascii() and chr(c).isalnum()) and c not in _ASCII_SPACES
+)
+
+
+@functools.lru_cache(maxsize=4096)
 def slugify(s: str) -> str:
-    s = s.strip().lower()
-    s = re.sub(r"<[^>]+>", "", s)
-    s = re.sub(r"[`*_~]", "", s)
-    s = re.sub(r"[^a-z0-9\s\-]", "", s)
-    s = re.sub(r"[\s\-]+", "-", s).strip("-")
+    if "<" in s:
+        s = HTML_TAG_RE.sub("", s)
+    try:
+        b = s.encode("ascii")
+    except UnicodeEncodeError:
+        s = "-".join(s.lower().translate(_SLUG_TRANS).split())
+    else:
+        b = b.translate(_ASCII_SLUG_TABLE, _ASCII_SLUG_DELETE)
+        s = b"-".join(b.split()).decode("ascii")
     return s or "section"
 
 
 def is_markdown(p: Path) -> bool:
-    return p.is_file() and p.suffix.lower() in {".md", ".markdown"}
+    return p.is_file() and p.suffix.lower() in MARKDOWN_SUFFIXES
 
 
-def safe_file_slug(root: Path, md_path: Path) -> str:
-    rel = md_path.resolve().relative_to(root.resolve()).as_posix()
-    base = slugify(rel.replace("/", " "))
-    h = hashlib.sha1(rel.encode("utf-8")).hexdigest()[:8]
-    return f"{base}-{h}"
+def read_md(p: Path) -> str:
+    # Decoding the raw bytes skips the TextIOWrapper that read_text sets up;
+    # line endings are normalised later by splitlines()
+    return p.read_bytes().decode("utf-8", "replace")
 
 
-def split_link_target(target: str) -> Tuple[str, str]:
-    if "#" in target:
-        a, b = target.split("#", 1)
-        return a, b
-    return target, ""
+def safe_file_slug(rel: str) -> str:
+    base = slugify(rel.replace("/", " "))
+    h = hashlib.blake2b(rel.encode("utf-8"), digest_size=4).hexdigest()
+    return f"{base}-{h}"
 
 
 def looks_like_url(s: str) -> bool:
-    return bool(re.match(r"^[a-zA-Z][a-zA-Z0-9+\-.]*://", s)) or s.startswith(
-        "mailto:"
+    return bool(URL_SCHEME_RE.match(s)) or s.startswith("mailto:")
+
+
+def run_mmdc(in_path: Path, out_path: Path, width: int, height: int) -> None:
+    cmd = [
+        "mmdc",
+        "-i",
+        str(in_path),
+        "-o",
+        str(out_path),
+        "-w",
+        str(width),
+        "-H",
+        str(height),
+        "-e",
+        "png",
+        "-b",
+        "transparent",
+    ]
+    subprocess.run(
+        cmd,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
     )
 
 
+def run_mmdc_batch(out_pngs: List[Path], width: int, height: int) -> bool:
+    # mmdc renders every block of a markdown input in one browser session,
+    # writing them next to the output as <name>-1.png, <name>-2.png, ...
+    diagrams_dir = out_pngs[0].parent
+    batch_md = diagrams_dir / "batch.md"
+    rendered_md = diagrams_dir / "batch-rendered.md"
+    blocks = [
+        "```mermaid\n"
+        + out_png.with_suffix(".mmd").read_text(encoding="utf-8")
+        + "```\n"
+        for out_png in out_pngs
+    ]
+    batch_md.write_text("\n".join(blocks), encoding="utf-8")
+    run_mmdc(batch_md, rendered_md, width, height)
+    rendered = [
+        diagrams_dir / f"{rendered_md.stem}-{n}.png"
+        for n in range(1, len(out_pngs) + 1)
+    ]
+    # mmdc may exit 0 without writing every image (e.g. a differently
+    # numbered output, or a diagram line it reads as a fence end)
+    if not all(p.exists() for p in rendered):
+        return False
+    for rendered_png, out_png in zip(rendered, out_pngs):
+        os.replace(rendered_png, out_png)
+    return True
+
+
+def load_from_cache(cache_path: Path, dst: Path) -> bool:
+    # Any problem reading the cache just counts as a miss
+    try:
+        shutil.copyfile(cache_path, dst)
+    except OSError:
+        return False
+    return True
+
+
+def store_in_cache(src: Path, cache_path: Path) -> None:
+    # Copy under a temporary name first so concurrent runs never see a partial
+    # file; an unwritable cache only costs the next run a re-render
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+
+def render_diagrams(
+    sources_by_png: Dict[Path, str],
+    cache_dir: Path,
+    width: int,
+    height: int,
+) -> Set[Path]:
+    to_render: List[Path] = []
+    for out_png in sources_by_png:
+        # Rendered output depends on the source and the requested size only
+        cache_png = cache_dir / f"{out_png.stem}-{width}x{height}.png"
+        if not load_from_cache(cache_png, out_png):
+            to_render.append(out_png)
+
+    failed: Set[Path] = set()
+    if not to_render:
+        return failed
+
+    try:
+        batch_ok = run_mmdc_batch(to_render, width, height)
+    except subprocess.CalledProcessError:
+        batch_ok = False
+    if not batch_ok:
+        # One bad diagram fails the whole batch; render them one by one to find it
+        with ThreadPoolExecutor(
+            max_workers=min(len(to_render), os.cpu_count() or 1)
+        ) as pool:
+            futures = {
+                pool.submit(
+                    run_mmdc,
+                    out_png.with_suffix(".mmd"),
+                    out_png,
+                    width,
+                    height,
+                ): out_png
+                for out_png in to_render
+            }
+            for future in as_completed(futures):
+                out_png = futures[future]
+                try:
+                    future.result()
+                except subprocess.CalledProcessError as e:
+                    print(
+                        f"Warning: mermaid diagram in {sources_by_png[out_png]} failed to render, skipping.\n"
+                        f"Error: {e.stderr[:200]}",
+                        file=sys.stderr,
+                    )
+                    failed.add(out_png)
+
+    for out_png in to_render:
+        if out_png not in failed:
+            store_in_cache(
+                out_png, cache_dir / f"{out_png.stem}-{width}x{height}.png"
+            )
+    return failed
+
+
+def _replace_mermaid_nl(match: re.Match) -> str:
+    # \n( -> space(, other \n -> space
+    return " (" if match.group("paren") else " "
+
+
+def _quote_edge_label(arrow: str, label: str) -> str:
+    if label.startswith('"') or not ("(" in label or ")" in label):
+        return f"{arrow}|{label}|"
+    return f'{arrow}|"{label}"|'
+
+
+def _quote_node_label(prefix: str, label: str) -> str:
+    # Skip if already quoted
+    if label.startswith('"'):
+        return f"{prefix}[{label}]"
+    # Quote if contains parentheses
+    if "(" in label or ")" in label:
+        return f'{prefix}["{label}"]'
+    return f"{prefix}[{label}]"
+
+
+def _clean_mermaid_match(match: re.Match) -> str:
+    # Fix common mermaid syntax issues:
+    # 1. Replace \n with space (Mermaid doesn't support line breaks)
+    if match.group("nl") is not None:
+        return _replace_mermaid_nl(match)
+
+    # 2. Quote edge labels containing parentheses: -->|text (parens)| -> -->|"text (parens)"|
+    if match.group("arrow") is not None:
+        label = MERMAID_NL_RE.sub(_replace_mermaid_nl, match.group("edge"))
+        return _quote_edge_label(match.group("arrow"), label)
+
+    # 3. Quote node labels containing parentheses: ID[text (parens)] -> ID["text (parens)"]
+    label = MERMAID_NL_RE.sub(_replace_mermaid_nl, match.group("node"))
+    return _quote_node_label(match.group("id") or "", label)
+
+
 def render_mermaid_blocks(
     md_text: str,
     diagrams_dir: Path,
-    diagram_key_prefix: str,
-    width: int,
-    height: int,
     flow_direction: str | None,
-) -> str:
+) -> Tuple[str, List[Path]]:
     out_lines: List[str] = []
+    out_pngs: List[Path] = []
     lines = md_text.splitlines()
     i = 0
-    mermaid_idx = 0
 
     while i < len(lines):
         line = lines[i]
-        if MERMAID_FENCE_RE.match(line):
+        # Plain string checks are much cheaper than a regex on every line
+        if line.rstrip().lower() == "```mermaid":
             i += 1
             block: List[str] = []
-            while i < len(lines) and not FENCE_END_RE.match(lines[i]):
+            while i < len(lines) and lines[i].rstrip() != "```":
                 block.append(lines[i])
                 i += 1
             if i >= len(lines):
@@ -86,102 +314,70 @@ def render_mermaid_blocks(
 
             mermaid_src = "\n".join(block).strip() + "\n"
             if flow_direction:
-                mermaid_src = re.sub(
-                    r"^(flowchart|graph)\s+[A-Z]{2}\b",
-                    rf"\1 {flow_direction}",
-                    mermaid_src,
-                    flags=re.MULTILINE,
+                mermaid_src = FLOW_DIRECTION_RE.sub(
+                    rf"\1 {flow_direction}", mermaid_src
                 )
-            # Fix common mermaid syntax issues:
-            # 1. Replace \n in node labels with space (Mermaid doesn't support line breaks)
-            mermaid_src = re.sub(
-                r"\\n\s*\(", r" (", mermaid_src
-            )  # \n( -> space(
-            mermaid_src = re.sub(r"\\n", " ", mermaid_src)  # other \n -> space
-
-            # 2. Quote edge labels containing parentheses: -->|text (parens)| -> -->|"text (parens)"|
-            def quote_edge_label(match):
-                arrow = match.group(1)  # -->, --, etc.
-                label = match.group(2)  # content between |
-                if label.startswith('"') or not ("(" in label or ")" in label):
-                    return match.group(0)
-                return f'{arrow}|"{label}"|'
-
-            mermaid_src = re.sub(
-                r"(--+[->]?)\|([^|]+)\|", quote_edge_label, mermaid_src
-            )
-
-            # 3. Quote node labels containing parentheses: ID[text (parens)] -> ID["text (parens)"]
-            def quote_node_label(match):
-                prefix = match.group(1)  # ID or empty
-                label = match.group(2)  # content inside []
-                # Skip if already quoted
-                if label.startswith('"'):
-                    return match.group(0)
-                # Quote if contains parentheses
-                if "(" in label or ")" in label:
-                    return f'{prefix}["{label}"]'
-                return match.group(0)
-
-            # Match: optional ID followed by [content]
-            mermaid_src = re.sub(
-                r"(\w+)?\[([^\]]+)\]", quote_node_label, mermaid_src
+            mermaid_src = MERMAID_CLEANUP_RE.sub(
+                _clean_mermaid_match, mermaid_src
             )
             mermaid_hash = hashlib.sha1(
                 mermaid_src.encode("utf-8")
             ).hexdigest()[:12]
-            out_png = (
-                diagrams_dir
-                / f"mermaid-{diagram_key_prefix}-{mermaid_idx}-{mermaid_hash}.png"
+            # Named by content only, so identical diagrams are rendered once
+            out_png = diagrams_dir / f"mermaid-{mermaid_hash}.png"
+            out_png.with_suffix(".mmd").write_text(
+                mermaid_src, encoding="utf-8"
             )
-            in_mmd = (
-                diagrams_dir
-                / f"mermaid-{diagram_key_prefix}-{mermaid_idx}-{mermaid_hash}.mmd"
-            )
-            in_mmd.write_text(mermaid_src, encoding="utf-8")
-
-            cmd = [
-                "mmdc",
-                "-i",
-                str(in_mmd),
-                "-o",
-                str(out_png),
-                "-w",
-                str(width),
-                "-H",
-                str(height),
-                "-b",
-                "transparent",
-            ]
-            try:
-                subprocess.run(
-                    cmd,
-                    check=True,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True,
-                )
-            except subprocess.CalledProcessError as e:
-                print(
-                    f"Warning: mermaid diagram {mermaid_idx} failed to render, skipping.\n"
-                    f"Error: {e.stderr[:200]}",
-                    file=sys.stderr,
-                )
-                # Insert a placeholder instead of failing
-                out_lines.append(
-                    "*[Mermaid diagram could not be rendered - check syntax]*"
-                )
-                mermaid_idx += 1
-                continue
+            out_pngs.append(out_png)
 
+            # Rendered later in one batch for the whole folder
             out_lines.append(f"![]({out_png.as_posix()})")
-            mermaid_idx += 1
             continue
 
         out_lines.append(line)
         i += 1
 
-    return "\n".join(out_lines) + "\n"
+    return "\n".join(out_lines) + "\n", out_pngs
+
+
+def run_pandoc_to_json(md_path: Path, json_path: Path) -> None:
+    cmd = [
+        "pandoc",
+        str(md_path),
+        "--from=markdown+hard_line_breaks",
+        "--to=json",
+        "-o",
+        str(json_path),
+    ]
+    subprocess.run(cmd, check=True)
+
+
+def merge_pandoc_json(json_paths: List[Path], out_json: Path) -> None:
+    # Writes the concatenated blocks as they are read, so only one file's
+    # AST is in memory at a time. Later metadata blocks win, as in pandoc.
+    api_version = None
+    meta: Dict[str, object] = {}
+    with open(out_json, "wb", buffering=1 << 20) as out:
+        out.write(b'{"blocks":[')
+        needs_comma = False
+        for idx, json_path in enumerate(json_paths):
+            doc = json.loads(json_path.read_bytes())
+            api_version = api_version or doc["pandoc-api-version"]
+            meta.update(doc["meta"])
+            if idx > 0:
+                if needs_comma:
+                    out.write(b",")
+                out.write(NEWPAGE_SEP)
+                needs_comma = True
+            if doc["blocks"]:
+                if needs_comma:
+                    out.write(b",")
+                out.write(json.dumps(doc["blocks"])[1:-1].encode("utf-8"))
+                needs_comma = True
+        out.write(
+            f'],"pandoc-api-version":{json.dumps(api_version)},'
+            f'"meta":{json.dumps(meta)}}}'.encode("utf-8")
+        )
 
 
 def tighten_lists(md_text: str) -> str:
@@ -217,16 +413,25 @@ def add_ids_and_rewrite_links(
     md_text: str,
     file_slug: str,
     file_slug_by_md_rel: Dict[str, str],
+    md_rels_by_name: Dict[str, List[str]],
     folder_root: Path,
     current_file: Path,
 ) -> str:
     heading_counts: Dict[str, int] = {}
+    current_dir = current_file.parent.as_posix()
+    folder_root_resolved = folder_root.resolve()
 
     def make_unique_id(base: str) -> str:
         n = heading_counts.get(base, 0) + 1
         heading_counts[base] = n
         return base if n == 1 else f"{base}-{n}"
 
+    def heading_with_id(title: str) -> str:
+        clean_title = title.strip()
+        base = f"{file_slug}-{slugify(clean_title)}"
+        hid = make_unique_id(base)
+        return f"{clean_title} {{#{hid}}}"
+
     def rewrite_heading_line(line: str) -> str:
         m = ATX_HEADING_RE.match(line)
         if not m:
@@ -234,112 +439,220 @@ def add_ids_and_rewrite_links(
         hashes, title = m.group(1), m.group(2)
         if "{#" in title:
             return line
-        clean_title = title.strip()
-        base = f"{file_slug}-{slugify(clean_title)}"
-        hid = make_unique_id(base)
-        return f"{hashes} {clean_title} {{#{hid}}}"
-
-    def rewrite_links(text: str) -> str:
-        def repl(match: re.Match) -> str:
-            label = match.group(1)
-            target = match.group(2).strip()
-
-            if looks_like_url(target):
-                return match.group(0)
-
-            path_part, frag = split_link_target(target)
-            path_part = path_part.strip()
+        return f"{hashes} {heading_with_id(title)}"
+
+    def is_setext_title(idx: int) -> bool:
+        # A single text line after a blank line, underlined with = or -
+        line = lines[idx]
+        return (
+            idx + 1 < len(lines)
+            and (idx == 0 or lines[idx - 1].strip() == "")
+            and line.strip() != ""
+            and "{#" not in line
+            and not line.startswith("    ")
+            and not line.lstrip().startswith((">", "|", "#"))
+            and not LIST_ITEM_RE.match(line)
+            and not SETEXT_UNDERLINE_RE.match(line)
+            and SETEXT_UNDERLINE_RE.match(lines[idx + 1]) is not None
+        )
 
-            # Skip empty paths or pure anchors
-            if path_part == "" or path_part.startswith("#"):
-                return match.group(0)
+    def rewrite_link(match: re.Match) -> str:
+        label, path_part, frag = match.groups()
 
-            # Only process markdown file links
-            if not path_part.lower().endswith((".md", ".markdown")):
-                return match.group(0)
+        if looks_like_url(path_part):
+            return match.group(0)
 
-            # Normalize path separators
-            path_part_normalized = path_part.replace("\\", "/")
+        # Normalize path separators
+        path_part_normalized = path_part.replace("\\", "/")
 
-            # Try multiple strategies to find the matching file:
-            # 1. Direct match (path is already relative to folder root)
-            linked_slug = file_slug_by_md_rel.get(path_part_normalized)
+        # Try multiple strategies to find the matching file:
+        # 1. Direct match (path is already relative to folder root)
+        linked_slug = file_slug_by_md_rel.get(path_part_normalized)
 
-            # 2. Try resolving relative to current file
-            if not linked_slug and not Path(path_part).is_absolute():
+        # 2. Try resolving relative to current file, without touching the disk
+        if not linked_slug and not os.path.isabs(path_part):
+            resolved_rel = os.path.relpath(
+                os.path.normpath(os.path.join(current_dir, path_part)),
+                folder_root_resolved,
+            )
+            if resolved_rel == ".." or resolved_rel.startswith("../"):
+                # Outside folder_root unless a symlink leads back into it
                 try:
-                    resolved = (current_file.parent / path_part).resolve()
-                    # Check if resolved path is within folder_root
-                    try:
-                        resolved_rel = resolved.relative_to(
-                            folder_root.resolve()
-                        ).as_posix()
-                        linked_slug = file_slug_by_md_rel.get(resolved_rel)
-                    except ValueError:
-                        # Resolved path is outside folder_root, skip
-                        pass
-                except Exception:
-                    pass
-
-            # 3. Try with folder name prefix removed (handle cases like "thinking/file.md")
-            if not linked_slug:
-                # Remove leading folder name if it matches the folder name
-                folder_name = folder_root.name
-                if path_part_normalized.startswith(f"{folder_name}/"):
-                    without_prefix = path_part_normalized[
-                        len(folder_name) + 1 :
-                    ]
-                    linked_slug = file_slug_by_md_rel.get(without_prefix)
-
-            # 4. Try just the filename if path has slashes
-            if not linked_slug and "/" in path_part_normalized:
-                filename = Path(path_part_normalized).name
-                # Check if there's exactly one file with this name
-                matching_files = [
-                    rel
-                    for rel in file_slug_by_md_rel.keys()
-                    if Path(rel).name == filename
-                ]
-                if len(matching_files) == 1:
-                    linked_slug = file_slug_by_md_rel.get(matching_files[0])
-
-            # Convert to internal PDF link if we found a match
-            if linked_slug:
-                if frag:
-                    frag_id = slugify(frag)
-                    return f"[{label}](#{linked_slug}-{frag_id})"
-                return f"[{label}](#{linked_slug})"
-
-            # No match found, return original link
-            return match.group(0)
-
-        return MD_LINK_RE.sub(repl, text)
+                    resolved_rel = (
+                        (current_file.parent / path_part)
+                        .resolve()
+                        .relative_to(folder_root_resolved)
+                        .as_posix()
+                    )
+                except (OSError, RuntimeError, ValueError):
+                    resolved_rel = ""
+            linked_slug = file_slug_by_md_rel.get(resolved_rel)
+
+        # 3. Try with folder name prefix removed (handle cases like "thinking/file.md")
+        if not linked_slug:
+            # Remove leading folder name if it matches the folder name
+            folder_name = folder_root.name
+            if path_part_normalized.startswith(f"{folder_name}/"):
+                without_prefix = path_part_normalized[len(folder_name) + 1 :]
+                linked_slug = file_slug_by_md_rel.get(without_prefix)
+
+        # 4. Try just the filename if path has slashes
+        if not linked_slug and "/" in path_part_normalized:
+            filename = Path(path_part_normalized).name
+            # Check if there's exactly one file with this name
+            matching_files = md_rels_by_name.get(filename, ())
+            if len(matching_files) == 1:
+                linked_slug = file_slug_by_md_rel.get(matching_files[0])
+
+        # Convert to internal PDF link if we found a match
+        if linked_slug:
+            if frag:
+                frag_id = slugify(frag)
+                return f"[{label}](#{linked_slug}-{frag_id})"
+            return f"[{label}](#{linked_slug})"
+
+        # No match found, return original link
+        return match.group(0)
 
     lines = md_text.splitlines()
     out: List[str] = []
     out.append(f"[]{{#{file_slug}}}")
     out.append("")
 
-    for line in lines:
-        out.append(rewrite_heading_line(line))
+    # Links never span lines, so both rewrites happen in the same pass.
+    # Setext headings get ids too: pandoc parses each file on its own, so
+    # its auto-generated ids would repeat across files.
+    open_fence = ""  # marker of the fenced code block we are inside, if any
+    for idx, line in enumerate(lines):
+        fence = CODE_FENCE_RE.match(line)
+        if open_fence:
+            # Closed only by the same character, at least as long, bare
+            if (
+                fence
+                and fence.group(1)[0] == open_fence[0]
+                and len(fence.group(1)) >= len(open_fence)
+                and fence.group(2).strip() == ""
+            ):
+                open_fence = ""
+        elif fence and not (
+            fence.group(1)[0] == "`" and "`" in fence.group(2)
+        ):
+            # A backtick fence's info string can't contain backticks
+            open_fence = fence.group(1)
+        else:
+            if line.startswith("#"):
+                line = rewrite_heading_line(line)
+            elif is_setext_title(idx):
+                line = heading_with_id(line)
+        if "[" in line:
+            line = MD_LINK_RE.sub(rewrite_link, line)
+        out.append(line)
+
+    return "\n".join(out) + "\n"
+
+
+# Read-only state shared by every process_one call in a pool worker; set
+# once per worker by init_worker instead of being pickled with each task
+class WorkerState(NamedTuple):
+    file_slug_by_md_rel: Dict[str, str]
+    md_rels_by_name: Dict[str, List[str]]
+    folder: Path
+    diagrams_dir: Path
+    flow_direction: str | None
+
+
+_worker_state: WorkerState | None = None
+
 
-    rewritten = "\n".join(out) + "\n"
-    rewritten = rewrite_links(rewritten)
-    return rewritten
+def init_worker(
+    file_slug_by_md_rel: Dict[str, str],
+    md_rels_by_name: Dict[str, List[str]],
+    folder: Path,
+    diagrams_dir: Path,
+    flow_direction: str | None,
+) -> None:
+    global _worker_state
+    _worker_state = WorkerState(
+        file_slug_by_md_rel=file_slug_by_md_rel,
+        md_rels_by_name=md_rels_by_name,
+        folder=folder,
+        diagrams_dir=diagrams_dir,
+        flow_direction=flow_direction,
+    )
+
+
+def process_one(
+    idx: int,
+    md_path: Path,
+    fragment_path: Path,
+    file_slug: str,
+) -> Tuple[int, List[Path]]:
+    state = _worker_state
+    assert state is not None, "init_worker must run before process_one"
+    text = read_md(md_path)
+    text, out_pngs = render_mermaid_blocks(
+        text,
+        state.diagrams_dir,
+        flow_direction=state.flow_direction,
+    )
+    text = add_ids_and_rewrite_links(
+        text,
+        file_slug,
+        state.file_slug_by_md_rel,
+        state.md_rels_by_name,
+        state.folder,
+        md_path,
+    )
+    text = tighten_lists(text)
+    fragment_path.write_text(text, encoding="utf-8")
+    return idx, out_pngs
+
+
+def is_excluded(name: str, rel: str, exclude: List[str]) -> bool:
+    return any(
+        fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(rel, pattern)
+        for pattern in exclude
+    )
 
 
-def find_all_markdowns(folder: Path) -> List[Path]:
-    files = [p for p in folder.rglob("*") if is_markdown(p)]
+def find_all_markdowns(folder: Path, exclude: List[str]) -> List[Path]:
+    # Walk with scandir so file types come from the directory listing
+    # instead of a stat per entry, and excluded folders are never entered
+    files: List[Path] = []
+    root = folder.as_posix()
+    dirs = [root]
+    while dirs:
+        try:
+            entries = list(os.scandir(dirs.pop()))
+        except PermissionError:
+            continue
+        for entry in entries:
+            if exclude and is_excluded(
+                entry.name, entry.path[len(root) + 1 :], exclude
+            ):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            elif (
+                os.path.splitext(entry.name)[1].lower() in MARKDOWN_SUFFIXES
+                and entry.is_file()
+            ):
+                files.append(Path(entry.path))
     return sorted(files, key=lambda p: p.as_posix().lower())
 
 
-def rotate_start(files: List[Path], start: Path) -> List[Path]:
-    start_res = start.resolve()
+def rotate_start(
+    files: List[Path], start: Path, resolved_by_path: Dict[Path, Path]
+) -> List[Path]:
+    # Keep the first index when several scanned paths are the same file
+    resolved_index: Dict[Path, int] = {}
     for i, p in enumerate(files):
-        if p.resolve() == start_res:
-            return files[i:] + files[:i]
-    die(f"start file not found in folder scan: {start}")
-    return files
+        resolved_index.setdefault(resolved_by_path[p], i)
+    i = resolved_index.get(start.resolve())
+    if i is None:
+        die(f"start file not found in folder scan: {start}")
+        return files
+    return files[i:] + files[:i]
 
 
 def main() -> None:
@@ -378,6 +691,20 @@ def main() -> None:
         default=None,
         help="Override Mermaid flowchart direction (e.g. LR for horizontal)",
     )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Skip files and folders matching this glob, by name or path "
+        "relative to the folder (e.g. node_modules); can be repeated",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default="~/.cache/pelagia/diagrams",
+        help="Where rendered Mermaid diagrams are cached between runs "
+        "(default: ~/.cache/pelagia/diagrams)",
+    )
     args = parser.parse_args()
 
     which_or_die("pandoc", "brew install pandoc")
@@ -397,56 +724,113 @@ def main() -> None:
     out_pdf = Path(args.out).expanduser().resolve()
     out_pdf.parent.mkdir(parents=True, exist_ok=True)
 
-    md_files = find_all_markdowns(folder)
+    cache_dir = Path(args.cache_dir).expanduser().resolve()
+
+    md_files = find_all_markdowns(folder, args.exclude)
     if not md_files:
         die(f"no markdown files found under: {folder}")
 
-    md_files = rotate_start(md_files, start_path)
-
-    file_slug_by_md_rel: Dict[str, str] = {}
-    for p in md_files:
-        rel = p.resolve().relative_to(folder).as_posix()
-        file_slug_by_md_rel[rel] = safe_file_slug(folder, p)
+    # Resolve each file only once; its folder-relative path is reused below
+    resolved_by_path = {p: p.resolve() for p in md_files}
+    md_files = rotate_start(md_files, start_path, resolved_by_path)
+
+    md_files_meta: List[Tuple[Path, str]] = [
+        (p, resolved_by_path[p].relative_to(folder).as_posix())
+        for p in md_files
+    ]
+    file_slug_by_md_rel: Dict[str, str] = {
+        rel: safe_file_slug(rel) for _, rel in md_files_meta
+    }
+    md_rels_by_name: Dict[str, List[str]] = defaultdict(list)
+    for rel in file_slug_by_md_rel:
+        md_rels_by_name[rel.rsplit("/", 1)[-1]].append(rel)
 
     with tempfile.TemporaryDirectory(prefix="mdfolder2pdf-") as tmp:
         tmpdir = Path(tmp)
         diagrams_dir = tmpdir / "diagrams"
         diagrams_dir.mkdir(parents=True, exist_ok=True)
 
-        combined_md = tmpdir / "combined.md"
-        parts: List[str] = []
+        fragments_dir = tmpdir / "fragments"
+        fragments_dir.mkdir(parents=True, exist_ok=True)
+        fragments = [
+            fragments_dir / f"{idx}.md" for idx in range(len(md_files))
+        ]
 
-        for idx, md_path in enumerate(md_files):
-            rel = md_path.resolve().relative_to(folder).as_posix()
-            file_slug = file_slug_by_md_rel[rel]
+        combined_json = tmpdir / "combined.json"
 
-            text = md_path.read_text(encoding="utf-8", errors="replace")
-            scaled_width = max(1, int(args.mermaid_width * args.mermaid_scale))
-            scaled_height = max(
-                1, int(args.mermaid_height * args.mermaid_scale)
-            )
-            text = render_mermaid_blocks(
-                text,
-                diagrams_dir,
-                diagram_key_prefix=file_slug,
-                width=scaled_width,
-                height=scaled_height,
-                flow_direction=args.mermaid_flow_direction,
-            )
-            text = add_ids_and_rewrite_links(
-                text,
-                file_slug,
+        scaled_width = max(1, int(args.mermaid_width * args.mermaid_scale))
+        scaled_height = max(1, int(args.mermaid_height * args.mermaid_scale))
+
+        out_pngs_by_idx: Dict[int, List[Path]] = {}
+        with ProcessPoolExecutor(
+            max_workers=min(len(md_files), os.cpu_count() or 1),
+            initializer=init_worker,
+            initargs=(
                 file_slug_by_md_rel,
+                md_rels_by_name,
                 folder,
-                md_path,
-            )
-            text = tighten_lists(text)
-
-            if idx > 0:
-                parts.append("\n```{=latex}\n\\newpage\n```\n")
-            parts.append(text)
-
-        combined_md.write_text("\n".join(parts), encoding="utf-8")
+                diagrams_dir,
+                args.mermaid_flow_direction,
+            ),
+        ) as pool:
+            futures = [
+                pool.submit(
+                    process_one,
+                    idx,
+                    md_path,
+                    fragments[idx],
+                    file_slug_by_md_rel[rel],
+                )
+                for idx, (md_path, rel) in enumerate(md_files_meta)
+            ]
+            for future in as_completed(futures):
+                idx, out_pngs = future.result()
+                if out_pngs:
+                    out_pngs_by_idx[idx] = out_pngs
+
+        # Render every diagram of the folder at once, before pandoc needs them
+        sources_by_png: Dict[Path, str] = {}
+        for idx in sorted(out_pngs_by_idx):
+            rel = md_files_meta[idx][1]
+            for out_png in out_pngs_by_idx[idx]:
+                sources_by_png.setdefault(out_png, rel)
+        failed = render_diagrams(
+            sources_by_png, cache_dir, scaled_width, scaled_height
+        )
+        if failed:
+            for idx, out_pngs in out_pngs_by_idx.items():
+                if failed.isdisjoint(out_pngs):
+                    continue
+                text = fragments[idx].read_text(encoding="utf-8")
+                for out_png in failed.intersection(out_pngs):
+                    # Insert a placeholder instead of failing
+                    text = text.replace(
+                        f"![]({out_png.as_posix()})",
+                        MERMAID_FAILED_PLACEHOLDER,
+                    )
+                fragments[idx].write_text(text, encoding="utf-8")
+
+        # Parse every file to pandoc's JSON AST in parallel; only the final
+        # typesetting of the merged document runs as a single pandoc
+        fragment_jsons = [
+            fragment.with_suffix(".json") for fragment in fragments
+        ]
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            futures = {
+                pool.submit(
+                    run_pandoc_to_json, fragment, fragment_jsons[idx]
+                ): idx
+                for idx, fragment in enumerate(fragments)
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except subprocess.CalledProcessError as e:
+                    rel = md_files_meta[futures[future]][1]
+                    die(
+                        f"pandoc failed on {rel} with exit code {e.returncode}"
+                    )
+        merge_pandoc_json(fragment_jsons, combined_json)
 
         resource_path = f"{folder.as_posix()}:{diagrams_dir.as_posix()}"
 
@@ -469,8 +853,8 @@ def main() -> None:
 
         cmd = [
             "pandoc",
-            str(combined_md),
-            "--from=markdown+hard_line_breaks",
+            str(combined_json),
+            "--from=json",
             "--pdf-engine=tectonic",
             f"--resource-path={resource_path}",
             "--toc",